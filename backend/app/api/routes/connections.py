@@ -5,56 +5,72 @@ from app.models.schemas import (
     ErrorResponse
 )
 from app.core.database import connection_manager, DatabaseConnection, DatabaseType
+from app.services.query_executor import health_check_executor, query_executor
+from types import MappingProxyType
 from typing import List
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# SQLAlchemy dialect+driver for each supported database type
+_DIALECTS = MappingProxyType({
+    "mysql": "mysql+pymysql",
+    "mariadb": "mysql+pymysql",  # MariaDB uses MySQL protocol with PyMySQL driver
+    "postgresql": "postgresql+psycopg",
+    "sqlite": "sqlite",
+})
+
 def build_connection_string(request: DatabaseConnectionRequest) -> str:
     """Build connection string from request parameters"""
     if request.connection_string:
         return request.connection_string
     
-    if request.db_type.lower() == "sqlite":
+    db_type = request.db_type.lower()
+    if db_type == "sqlite":
         return f"sqlite:///{request.database}"
     
-    # Use proper SQLAlchemy dialect+driver format
-    db_type_mapping = {
-        "mysql": "mysql+pymysql",
-        "mariadb": "mysql+pymysql",  # MariaDB uses MySQL protocol with PyMySQL driver
-        "postgresql": "postgresql+psycopg2"
-    }
-    
-    dialect = db_type_mapping.get(request.db_type.lower(), request.db_type.lower())
-    base_url = f"{dialect}://"
-    
-    if request.username and request.password:
-        base_url += f"{request.username}:{request.password}@"
-    elif request.username:
-        base_url += f"{request.username}@"
+    dialect = _DIALECTS.get(db_type, db_type)
     
+    netloc = ""
+    if request.username:
+        netloc = request.username
+        if request.password:
+            netloc += f":{request.password}"
+        netloc += "@"
     if request.host:
-        base_url += request.host
+        netloc += request.host
         if request.port:
-            base_url += f":{request.port}"
-    
-    base_url += f"/{request.database}"
+            netloc += f":{request.port}"
     
-    return base_url
+    return f"{dialect}://{netloc}/{request.database}"
+
+# Health checks slower than this report the connection as disconnected
+CONNECTION_CHECK_TIMEOUT = 2.0
+
+async def _check_connection(connection: DatabaseConnection) -> bool:
+    """Test a connection in a worker thread, giving up after a timeout"""
+    try:
+        return await asyncio.wait_for(
+            health_check_executor.run(connection.test_connection),
+            timeout=CONNECTION_CHECK_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Connection test timed out after {CONNECTION_CHECK_TIMEOUT}s")
+        return False
 
 @router.post("/", response_model=DatabaseConnectionResponse)
 async def create_connection(request: DatabaseConnectionRequest):
     """Create a new database connection"""
     try:
         # Validate database type
-        try:
-            db_type = DatabaseType(request.db_type.lower())
-        except ValueError:
+        if request.db_type.lower() not in _DIALECTS:
             raise HTTPException(
                 status_code=400,
                 detail=f"Unsupported database type: {request.db_type}"
             )
+        db_type = DatabaseType(request.db_type.lower())
         
         # Build connection string
         connection_string = build_connection_string(request)
@@ -63,7 +79,9 @@ async def create_connection(request: DatabaseConnectionRequest):
         db_connection = DatabaseConnection(connection_string, db_type)
         
         # Add to connection manager
-        success = connection_manager.add_connection(request.connection_id, db_connection)
+        success = await query_executor.run(
+            connection_manager.add_connection, request.connection_id, db_connection
+        )
         
         if not success:
             raise HTTPException(
@@ -83,20 +101,36 @@ async def create_connection(request: DatabaseConnectionRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/", response_model=List[DatabaseConnectionResponse])
-async def list_connections():
-    """List all database connections"""
-    connections = []
+async def list_connections(check: bool = False):
+    """List all database connections
+    
+    Connections are only pinged when ``check`` is set; otherwise they are
+    reported as connected, since only successful connections are registered.
+    """
+    registered = []
     for connection_id in connection_manager.list_connections():
         connection = connection_manager.get_connection(connection_id)
         if connection:
-            connections.append(DatabaseConnectionResponse(
-                connection_id=connection_id,
-                db_type=connection.db_type.value,
-                database="",  # We don't store this info separately
-                status="connected" if connection.test_connection() else "disconnected"
-            ))
+            registered.append((connection_id, connection))
     
-    return connections
+    # Ping all databases concurrently so the listing takes one round trip,
+    # not one per connection
+    if check:
+        results = await asyncio.gather(
+            *(_check_connection(connection) for _, connection in registered)
+        )
+    else:
+        results = [True] * len(registered)
+    
+    return [
+        DatabaseConnectionResponse(
+            connection_id=connection_id,
+            db_type=connection.db_type.value,
+            database="",  # We don't store this info separately
+            status="connected" if is_connected else "disconnected"
+        )
+        for (connection_id, connection), is_connected in zip(registered, results)
+    ]
 
 @router.delete("/{connection_id}")
 async def delete_connection(connection_id: str):
@@ -115,7 +149,7 @@ async def test_connection(connection_id: str):
     if not connection:
         raise HTTPException(status_code=404, detail="Connection not found")
     
-    is_connected = connection.test_connection()
+    is_connected = await health_check_executor.run(connection.test_connection)
     return {
         "connection_id": connection_id,
         "status": "connected" if is_connected else "disconnected"
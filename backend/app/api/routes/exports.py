@@ -1,55 +1,106 @@
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from app.models.schemas import ExportRequest
 from app.core.database import connection_manager
-from app.api.routes.queries import query_history
+from app.services.history_store import history_store
+from app.services.query_executor import query_executor
+from app.utils.orjson_response import json_default
+from sqlalchemy import Row
 import csv
-import io
-from typing import Dict, Any, List
-import json
+import hashlib
+from itertools import islice
+from types import SimpleNamespace
+from typing import Dict, Any, Iterator, List
+import orjson
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Flush export buffers to the client once they grow past this size
+EXPORT_FLUSH_SIZE = 64 * 1024
+
+# Number of rows written per CSV chunk
+CSV_FLUSH_ROWS = 1000
+
+def _stream_csv(columns: List[str], first_row: Row, rows: Iterator[Row]) -> Iterator[str]:
+    """Yield CSV chunks for an already started row stream"""
+    # csv.writer only needs a write() method; collecting the written lines in
+    # a list avoids StringIO's buffer reallocation, seek and truncate
+    lines: List[str] = []
+    writer = csv.writer(SimpleNamespace(write=lines.append))
+    writer.writerow(columns)
+    writer.writerow(first_row)
+    
+    while True:
+        batch = list(islice(rows, CSV_FLUSH_ROWS))
+        if not batch:
+            break
+        writer.writerows(batch)
+        yield "".join(lines)
+        lines.clear()
+    
+    if lines:
+        yield "".join(lines)
+
+def _stream_json(query_info: Dict[str, Any], columns: List[str],
+                 rows: Iterator[Row]) -> Iterator[bytes]:
+    """Yield a JSON document for a row stream
+    
+    Rows are written first so ``query_info`` can carry the final row count.
+    """
+    buffer = bytearray(b'{"columns":')
+    buffer += orjson.dumps(columns)
+    buffer += b',"rows":['
+    row_count = 0
+    
+    for row in rows:
+        if row_count:
+            buffer += b","
+        buffer += orjson.dumps(tuple(row), default=json_default)
+        row_count += 1
+        if len(buffer) > EXPORT_FLUSH_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    
+    query_info["row_count"] = row_count
+    buffer += b'],"query_info":'
+    buffer += orjson.dumps(query_info, default=json_default)
+    buffer += b"}"
+    yield bytes(buffer)
+
 @router.post("/csv/{query_id}")
 async def export_to_csv(query_id: str):
     """Export query results to CSV format"""
     try:
-        if query_id not in query_history:
+        history_entry = await query_executor.run(history_store.get, query_id)
+        if not history_entry:
             raise HTTPException(status_code=404, detail="Query not found")
         
-        history_entry = query_history[query_id]
-        
         # Get database connection
         connection = connection_manager.get_connection(history_entry.connection_id)
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        # Re-execute query to get fresh data
-        data = connection.execute_query(history_entry.generated_sql)
+        # Re-execute query to get fresh data, streaming rows from the database
+        columns, rows = await query_executor.run(connection.execute_query_stream, history_entry.generated_sql)
+        first_row = await query_executor.run(next, rows, None)
         
-        if not data:
+        if first_row is None:
             raise HTTPException(status_code=400, detail="No data to export")
         
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=data[0].keys())
-        writer.writeheader()
-        writer.writerows(data)
-        
-        # Get CSV content
-        csv_content = output.getvalue()
-        output.close()
-        
-        # Return CSV response
-        return Response(
-            content=csv_content,
+        # Return CSV response, written out as rows arrive
+        return StreamingResponse(
+            _stream_csv(columns, first_row, rows),
             media_type="text/csv",
             headers={
                 "Content-Disposition": f"attachment; filename=query_{query_id[:8]}.csv"
             }
         )
-        
+    
+    except HTTPException:
+        # 404 / "No data to export" responses pass through unchanged
+        raise
     except Exception as e:
         logger.error(f"CSV export failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -58,134 +109,143 @@ async def export_to_csv(query_id: str):
 async def export_to_json(query_id: str):
     """Export query results to JSON format"""
     try:
-        if query_id not in query_history:
+        history_entry = await query_executor.run(history_store.get, query_id)
+        if not history_entry:
             raise HTTPException(status_code=404, detail="Query not found")
         
-        history_entry = query_history[query_id]
-        
         # Get database connection
         connection = connection_manager.get_connection(history_entry.connection_id)
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        # Re-execute query to get fresh data
-        data = connection.execute_query(history_entry.generated_sql)
+        # Re-execute query to get fresh data, streaming rows from the database
+        columns, rows = await query_executor.run(connection.execute_query_stream, history_entry.generated_sql)
         
-        # Create export data structure
-        export_data = {
-            "query_info": {
-                "query_id": query_id,
-                "original_query": history_entry.original_query,
-                "generated_sql": history_entry.generated_sql,
-                "connection_id": history_entry.connection_id,
-                "timestamp": history_entry.timestamp.isoformat(),
-                "execution_time": history_entry.execution_time,
-                "row_count": len(data),
-                "visualization_type": history_entry.visualization_type
-            },
-            "data": data
+        query_info = {
+            "query_id": query_id,
+            "original_query": history_entry.original_query,
+            "generated_sql": history_entry.generated_sql,
+            "connection_id": history_entry.connection_id,
+            "timestamp": history_entry.timestamp,
+            "execution_time": history_entry.execution_time,
+            "visualization_type": history_entry.visualization_type
         }
         
-        # Return JSON response
-        return Response(
-            content=json.dumps(export_data, indent=2, default=str),
+        # Return JSON response, written out as rows arrive
+        return StreamingResponse(
+            _stream_json(query_info, columns, rows),
             media_type="application/json",
             headers={
                 "Content-Disposition": f"attachment; filename=query_{query_id[:8]}.json"
             }
         )
-        
+    
+    except HTTPException:
+        # 404 / "No data to export" responses pass through unchanged
+        raise
     except Exception as e:
         logger.error(f"JSON export failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Preset query templates for common analytics; these never change at runtime,
+# so the response is serialized once at import time
+_TEMPLATES = [
+    {
+        "id": "sales_by_month",
+        "name": "Sales by Month",
+        "description": "Show total sales grouped by month",
+        "template": "Show total sales by month for the last 12 months",
+        "category": "Sales Analytics",
+        "visualization_hint": "line_chart"
+    },
+    {
+        "id": "top_products",
+        "name": "Top Products by Revenue",
+        "description": "Find the best performing products",
+        "template": "What are the top 10 products by revenue?",
+        "category": "Product Analytics",
+        "visualization_hint": "bar_chart"
+    },
+    {
+        "id": "customer_segments",
+        "name": "Customer Segments",
+        "description": "Analyze customer distribution",
+        "template": "How many customers do we have by region?",
+        "category": "Customer Analytics",
+        "visualization_hint": "pie_chart"
+    },
+    {
+        "id": "average_order_value",
+        "name": "Average Order Value",
+        "description": "Calculate average order value by segment",
+        "template": "Show average order value by customer segment",
+        "category": "Sales Analytics",
+        "visualization_hint": "bar_chart"
+    },
+    {
+        "id": "total_revenue",
+        "name": "Total Revenue",
+        "description": "Show total revenue for a period",
+        "template": "What is the total revenue for this year?",
+        "category": "KPIs",
+        "visualization_hint": "kpi"
+    },
+    {
+        "id": "customer_growth",
+        "name": "Customer Growth",
+        "description": "Track new customer acquisitions",
+        "template": "Show new customer registrations by month",
+        "category": "Growth Analytics",
+        "visualization_hint": "line_chart"
+    },
+    {
+        "id": "product_categories",
+        "name": "Sales by Category",
+        "description": "Compare sales across product categories",
+        "template": "Show total sales by product category",
+        "category": "Product Analytics",
+        "visualization_hint": "pie_chart"
+    },
+    {
+        "id": "weekly_orders",
+        "name": "Weekly Order Trends",
+        "description": "Analyze order patterns by day of week",
+        "template": "How many orders were placed each day this week?",
+        "category": "Order Analytics",
+        "visualization_hint": "bar_chart"
+    },
+    {
+        "id": "inventory_levels",
+        "name": "Inventory Status",
+        "description": "Check current inventory levels",
+        "template": "Show current inventory levels by product",
+        "category": "Inventory Analytics",
+        "visualization_hint": "table"
+    },
+    {
+        "id": "user_activity",
+        "name": "User Activity",
+        "description": "Track user engagement metrics",
+        "template": "Show user login activity by month",
+        "category": "User Analytics",
+        "visualization_hint": "line_chart"
+    }
+]
+_CATEGORIES = tuple(sorted({t["category"] for t in _TEMPLATES}))
+_TEMPLATES_PAYLOAD = orjson.dumps({"templates": _TEMPLATES, "categories": _CATEGORIES})
+_TEMPLATES_ETAG = f'"{hashlib.md5(_TEMPLATES_PAYLOAD).hexdigest()}"'
+
 @router.get("/templates")
-async def get_query_templates():
+async def get_query_templates(request: Request):
     """Get preset query templates for common analytics"""
-    templates = [
-        {
-            "id": "sales_by_month",
-            "name": "Sales by Month",
-            "description": "Show total sales grouped by month",
-            "template": "Show total sales by month for the last 12 months",
-            "category": "Sales Analytics",
-            "visualization_hint": "line_chart"
-        },
-        {
-            "id": "top_products",
-            "name": "Top Products by Revenue",
-            "description": "Find the best performing products",
-            "template": "What are the top 10 products by revenue?",
-            "category": "Product Analytics",
-            "visualization_hint": "bar_chart"
-        },
-        {
-            "id": "customer_segments",
-            "name": "Customer Segments",
-            "description": "Analyze customer distribution",
-            "template": "How many customers do we have by region?",
-            "category": "Customer Analytics",
-            "visualization_hint": "pie_chart"
-        },
-        {
-            "id": "average_order_value",
-            "name": "Average Order Value",
-            "description": "Calculate average order value by segment",
-            "template": "Show average order value by customer segment",
-            "category": "Sales Analytics",
-            "visualization_hint": "bar_chart"
-        },
-        {
-            "id": "total_revenue",
-            "name": "Total Revenue",
-            "description": "Show total revenue for a period",
-            "template": "What is the total revenue for this year?",
-            "category": "KPIs",
-            "visualization_hint": "kpi"
-        },
-        {
-            "id": "customer_growth",
-            "name": "Customer Growth",
-            "description": "Track new customer acquisitions",
-            "template": "Show new customer registrations by month",
-            "category": "Growth Analytics",
-            "visualization_hint": "line_chart"
-        },
-        {
-            "id": "product_categories",
-            "name": "Sales by Category",
-            "description": "Compare sales across product categories",
-            "template": "Show total sales by product category",
-            "category": "Product Analytics",
-            "visualization_hint": "pie_chart"
-        },
-        {
-            "id": "weekly_orders",
-            "name": "Weekly Order Trends",
-            "description": "Analyze order patterns by day of week",
-            "template": "How many orders were placed each day this week?",
-            "category": "Order Analytics",
-            "visualization_hint": "bar_chart"
-        },
-        {
-            "id": "inventory_levels",
-            "name": "Inventory Status",
-            "description": "Check current inventory levels",
-            "template": "Show current inventory levels by product",
-            "category": "Inventory Analytics",
-            "visualization_hint": "table"
-        },
-        {
-            "id": "user_activity",
-            "name": "User Activity",
-            "description": "Track user engagement metrics",
-            "template": "Show user login activity by month",
-            "category": "User Analytics",
-            "visualization_hint": "line_chart"
-        }
-    ]
+    if request.headers.get("if-none-match") == _TEMPLATES_ETAG:
+        return Response(status_code=304, headers={"ETag": _TEMPLATES_ETAG})
     
-    return {
-        "templates": templates,
-        "categories": list(set(t["category"] for t in templates))
-    }
\ No newline at end of file
+    return Response(
+        content=_TEMPLATES_PAYLOAD,
+        media_type="application/json",
+        headers={
+            "ETag": _TEMPLATES_ETAG,
+            "Cache-Control": "public, max-age=3600"
+        }
+    )
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.models.schemas import (
     NaturalLanguageQuery, 
     QueryResult, 
@@ -7,23 +8,49 @@ from app.models.schemas import (
 )
 from app.core.database import connection_manager
 from app.services.ai_service import ai_service
-import uuid
+from app.services.history_store import history_store
+from app.services.query_executor import query_executor
+from app.utils.orjson_response import ORJSONResponse, json_default
+from sqlalchemy import Row
 import time
-from datetime import datetime
-from typing import List, Dict, Any
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterator
 import logging
+import orjson
+
+try:
+    from uuid import uuid7
+except ImportError:  # Python < 3.14
+    from uuid6 import uuid7
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# In-memory storage for query history (in production, use a proper database)
-query_history: Dict[str, QueryHistory] = {}
+# Visualization types the frontend knows how to render
+VALID_VISUALIZATIONS = frozenset({"table", "bar_chart", "line_chart", "pie_chart", "kpi"})
+
+# Flush streamed results to the client once the buffer grows past this size
+STREAM_FLUSH_SIZE = 64 * 1024
+
+def _stream_ndjson(columns: List[str], rows: Iterator[Row]) -> Iterator[bytes]:
+    """Yield newline-delimited JSON: the column names, then one array per row"""
+    buffer = bytearray(orjson.dumps({"columns": columns}))
+    buffer += b"\n"
+    
+    for row in rows:
+        buffer += orjson.dumps(tuple(row), default=json_default)
+        buffer += b"\n"
+        if len(buffer) > STREAM_FLUSH_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    
+    yield bytes(buffer)
 
 @router.get("/ai/status")
 async def get_ai_status():
     """Get AI service status and test connectivity"""
     try:
-        status_info = ai_service.test_connection()
+        status_info = await ai_service.test_connection()
         return status_info
     except Exception as e:
         logger.error(f"AI status check failed: {e}")
@@ -44,44 +71,42 @@ async def execute_natural_language_query(request: NaturalLanguageQuery):
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        # Test connection
-        if not connection.test_connection():
-            raise HTTPException(status_code=400, detail="Database connection is not available")
-        
         # Get schema information
-        schema_info = connection.get_schema_info()
+        schema_info = await query_executor.run(connection.get_schema_info)
         
         # Generate SQL using AI
-        ai_result = ai_service.generate_sql(request.query, schema_info)
+        ai_result = await ai_service.generate_sql(request.query, schema_info)
         generated_sql = ai_result["sql"]
         
         # Execute the query
-        start_time = time.time()
-        data = connection.execute_query(generated_sql)
-        execution_time = time.time() - start_time
+        timestamp = datetime.now(timezone.utc)
+        start_time = time.perf_counter_ns()
+        data = await query_executor.run(connection.execute_query, generated_sql)
+        execution_time = (time.perf_counter_ns() - start_time) / 1e9
         
-        # Extract columns
-        columns = list(data[0].keys()) if data else []
+        columns = data["columns"]
+        rows = data["rows"]
         
         # Suggest visualization type
         visualization_type = ai_result.get("visualization_hint", "table")
-        if not visualization_type or visualization_type not in ["table", "bar_chart", "line_chart", "pie_chart", "kpi"]:
-            visualization_type = ai_service.suggest_visualization(data, columns)
+        if not visualization_type or visualization_type not in VALID_VISUALIZATIONS:
+            visualization_type = ai_service.suggest_visualization(rows, columns)
         
         # Generate query ID
-        query_id = str(uuid.uuid4())
+        query_id = str(uuid7())
         
-        # Create result
-        result = QueryResult(
+        # Create result (rows come straight from the database, so skip
+        # revalidating and copying every row)
+        result = QueryResult.model_construct(
             query_id=query_id,
             original_query=request.query,
             generated_sql=generated_sql,
-            data=data,
             columns=columns,
-            row_count=len(data),
+            rows=rows,
+            row_count=len(rows),
             execution_time=execution_time,
             visualization_type=visualization_type,
-            timestamp=datetime.now()
+            timestamp=timestamp
         )
         
         # Store in history
@@ -90,14 +115,14 @@ async def execute_natural_language_query(request: NaturalLanguageQuery):
             original_query=request.query,
             generated_sql=generated_sql,
             connection_id=request.connection_id,
-            timestamp=datetime.now(),
+            timestamp=timestamp,
             execution_time=execution_time,
-            row_count=len(data),
+            row_count=len(rows),
             visualization_type=visualization_type
         )
-        query_history[query_id] = history_entry
+        await query_executor.run(history_store.add, history_entry)
         
-        return result
+        return ORJSONResponse(dict(result))
         
     except Exception as e:
         logger.error(f"Query execution failed: {e}")
@@ -106,66 +131,54 @@ async def execute_natural_language_query(request: NaturalLanguageQuery):
 @router.get("/history", response_model=List[QueryHistory])
 async def get_query_history(connection_id: str = None, limit: int = 50):
     """Get query history"""
-    history_list = list(query_history.values())
-    
-    # Filter by connection_id if provided
-    if connection_id:
-        history_list = [h for h in history_list if h.connection_id == connection_id]
-    
-    # Sort by timestamp (most recent first)
-    history_list.sort(key=lambda x: x.timestamp, reverse=True)
-    
-    # Apply limit
-    return history_list[:limit]
+    return await query_executor.run(history_store.list, connection_id, limit)
 
 @router.get("/{query_id}", response_model=QueryHistory)
 async def get_query_by_id(query_id: str):
     """Get a specific query from history"""
-    if query_id not in query_history:
+    history_entry = await query_executor.run(history_store.get, query_id)
+    if not history_entry:
         raise HTTPException(status_code=404, detail="Query not found")
     
-    return query_history[query_id]
+    return history_entry
 
 @router.post("/{query_id}/rerun", response_model=QueryResult)
 async def rerun_query(query_id: str):
     """Rerun a query from history"""
-    if query_id not in query_history:
+    history_entry = await query_executor.run(history_store.get, query_id)
+    if not history_entry:
         raise HTTPException(status_code=404, detail="Query not found")
     
-    history_entry = query_history[query_id]
-    
     # Get database connection
     connection = connection_manager.get_connection(history_entry.connection_id)
     if not connection:
         raise HTTPException(status_code=404, detail="Connection not found")
     
-    # Test connection
-    if not connection.test_connection():
-        raise HTTPException(status_code=400, detail="Database connection is not available")
-    
     try:
         # Execute the stored SQL query
-        start_time = time.time()
-        data = connection.execute_query(history_entry.generated_sql)
-        execution_time = time.time() - start_time
+        timestamp = datetime.now(timezone.utc)
+        start_time = time.perf_counter_ns()
+        data = await query_executor.run(connection.execute_query, history_entry.generated_sql)
+        execution_time = (time.perf_counter_ns() - start_time) / 1e9
         
-        # Extract columns
-        columns = list(data[0].keys()) if data else []
+        columns = data["columns"]
+        rows = data["rows"]
         
         # Generate new query ID for the rerun
-        new_query_id = str(uuid.uuid4())
+        new_query_id = str(uuid7())
         
-        # Create result
-        result = QueryResult(
+        # Create result (rows come straight from the database, so skip
+        # revalidating and copying every row)
+        result = QueryResult.model_construct(
             query_id=new_query_id,
             original_query=history_entry.original_query,
             generated_sql=history_entry.generated_sql,
-            data=data,
             columns=columns,
-            row_count=len(data),
+            rows=rows,
+            row_count=len(rows),
             execution_time=execution_time,
             visualization_type=history_entry.visualization_type,
-            timestamp=datetime.now()
+            timestamp=timestamp
         )
         
         # Store new entry in history
@@ -174,26 +187,49 @@ async def rerun_query(query_id: str):
             original_query=history_entry.original_query,
             generated_sql=history_entry.generated_sql,
             connection_id=history_entry.connection_id,
-            timestamp=datetime.now(),
+            timestamp=timestamp,
             execution_time=execution_time,
-            row_count=len(data),
+            row_count=len(rows),
             visualization_type=history_entry.visualization_type
         )
-        query_history[new_query_id] = new_history_entry
+        await query_executor.run(history_store.add, new_history_entry)
         
-        return result
+        return ORJSONResponse(dict(result))
         
     except Exception as e:
         logger.error(f"Query rerun failed: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/{query_id}/stream")
+async def stream_query(query_id: str):
+    """Rerun a query from history and stream its rows as newline-delimited JSON
+    
+    Unlike rerun, rows are sent as they are fetched from a server-side cursor,
+    so large result sets are never held in memory. The first line holds the
+    column names.
+    """
+    history_entry = await query_executor.run(history_store.get, query_id)
+    if not history_entry:
+        raise HTTPException(status_code=404, detail="Query not found")
+    
+    # Get database connection
+    connection = connection_manager.get_connection(history_entry.connection_id)
+    if not connection:
+        raise HTTPException(status_code=404, detail="Connection not found")
+    
+    try:
+        columns, rows = await query_executor.run(connection.execute_query_stream, history_entry.generated_sql)
+    except Exception as e:
+        logger.error(f"Query stream failed: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(_stream_ndjson(columns, rows), media_type="application/x-ndjson")
+
 @router.delete("/{query_id}")
 async def delete_query_from_history(query_id: str):
     """Delete a query from history"""
-    if query_id not in query_history:
+    if not await query_executor.run(history_store.delete, query_id):
         raise HTTPException(status_code=404, detail="Query not found")
-    
-    del query_history[query_id]
     return {"message": f"Query {query_id} deleted from history"}
 
 @router.post("/sql", response_model=QueryResult)
@@ -205,35 +241,33 @@ async def execute_raw_sql(connection_id: str, sql: str):
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        # Test connection
-        if not connection.test_connection():
-            raise HTTPException(status_code=400, detail="Database connection is not available")
-        
         # Execute the query
-        start_time = time.time()
-        data = connection.execute_query(sql)
-        execution_time = time.time() - start_time
+        timestamp = datetime.now(timezone.utc)
+        start_time = time.perf_counter_ns()
+        data = await query_executor.run(connection.execute_query, sql)
+        execution_time = (time.perf_counter_ns() - start_time) / 1e9
         
-        # Extract columns
-        columns = list(data[0].keys()) if data else []
+        columns = data["columns"]
+        rows = data["rows"]
         
         # Suggest visualization type
-        visualization_type = ai_service.suggest_visualization(data, columns)
+        visualization_type = ai_service.suggest_visualization(rows, columns)
         
         # Generate query ID
-        query_id = str(uuid.uuid4())
+        query_id = str(uuid7())
         
-        # Create result
-        result = QueryResult(
+        # Create result (rows come straight from the database, so skip
+        # revalidating and copying every row)
+        result = QueryResult.model_construct(
             query_id=query_id,
             original_query="Raw SQL Query",
             generated_sql=sql,
-            data=data,
             columns=columns,
-            row_count=len(data),
+            rows=rows,
+            row_count=len(rows),
             execution_time=execution_time,
             visualization_type=visualization_type,
-            timestamp=datetime.now()
+            timestamp=timestamp
         )
         
         # Store in history
@@ -242,14 +276,14 @@ async def execute_raw_sql(connection_id: str, sql: str):
             original_query="Raw SQL Query",
             generated_sql=sql,
             connection_id=connection_id,
-            timestamp=datetime.now(),
+            timestamp=timestamp,
             execution_time=execution_time,
-            row_count=len(data),
+            row_count=len(rows),
             visualization_type=visualization_type
         )
-        query_history[query_id] = history_entry
+        await query_executor.run(history_store.add, history_entry)
         
-        return result
+        return ORJSONResponse(dict(result))
         
     except Exception as e:
         logger.error(f"Raw SQL execution failed: {e}")
@@ -1,11 +1,21 @@
 from fastapi import APIRouter, HTTPException
 from app.models.schemas import SchemaInfo
 from app.core.database import connection_manager
+from typing import Any, Dict
+from app.services.query_executor import query_executor
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _table_payload(table_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a cached table entry to plain dicts for the response"""
+    return {**table_info, "columns": [col._asdict() for col in table_info["columns"]]}
+
+def _tables_payload(tables: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert every cached table entry to plain dicts for the response"""
+    return {name: _table_payload(table_info) for name, table_info in tables.items()}
+
 @router.get("/{connection_id}", response_model=SchemaInfo)
 async def get_schema(connection_id: str):
     """Get database schema information"""
@@ -14,10 +24,10 @@ async def get_schema(connection_id: str):
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        schema_info = connection.get_schema_info()
+        schema_info = await query_executor.run(connection.get_schema_info)
         
         return SchemaInfo(
-            tables=schema_info["tables"],
+            tables=_tables_payload(schema_info["tables"]),
             database_type=schema_info["database_type"]
         )
         
@@ -25,6 +35,26 @@ async def get_schema(connection_id: str):
         logger.error(f"Schema retrieval failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/{connection_id}/refresh", response_model=SchemaInfo)
+async def refresh_schema(connection_id: str):
+    """Discard the cached schema and read it again from the database"""
+    try:
+        connection = connection_manager.get_connection(connection_id)
+        if not connection:
+            raise HTTPException(status_code=404, detail="Connection not found")
+        
+        connection_manager.invalidate_schema_cache(connection_id)
+        schema_info = await query_executor.run(connection.get_schema_info)
+        
+        return SchemaInfo(
+            tables=_tables_payload(schema_info["tables"]),
+            database_type=schema_info["database_type"]
+        )
+        
+    except Exception as e:
+        logger.error(f"Schema refresh failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{connection_id}/tables")
 async def list_tables(connection_id: str):
     """List all tables in the database"""
@@ -33,7 +63,7 @@ async def list_tables(connection_id: str):
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        schema_info = connection.get_schema_info()
+        schema_info = await query_executor.run(connection.get_schema_info)
         
         return {
             "tables": list(schema_info["tables"].keys()),
@@ -52,14 +82,14 @@ async def get_table_info(connection_id: str, table_name: str):
         if not connection:
             raise HTTPException(status_code=404, detail="Connection not found")
         
-        schema_info = connection.get_schema_info()
+        schema_info = await query_executor.run(connection.get_schema_info)
         
         if table_name not in schema_info["tables"]:
             raise HTTPException(status_code=404, detail=f"Table '{table_name}' not found")
         
         return {
             "table_name": table_name,
-            "table_info": schema_info["tables"][table_name]
+            "table_info": _table_payload(schema_info["tables"][table_name])
         }
         
     except Exception as e:
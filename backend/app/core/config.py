@@ -1,6 +1,10 @@
 import os
-from pydantic import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Settings(BaseSettings):
     # AI Configuration
@@ -24,6 +28,19 @@ class Settings(BaseSettings):
     # Model parameters
     ai_temperature: float = 0.1
     ai_max_tokens: int = 1000
+    # Seconds to wait for the AI provider (local models can be slow)
+    ai_timeout: float = 600
+    
+    # Reuse generated SQL for repeated questions against the same schema
+    # (only at temperature <= 0.2, where answers are near-deterministic)
+    ai_cache_enabled: bool = True
+    ai_cache_size: int = 1024
+    ai_cache_ttl: int = 3600
+    
+    # Send at most this many tables (those best matching the question, plus
+    # the tables their foreign keys reference) to the model; 0 always sends
+    # the whole schema
+    ai_schema_max_tables: int = 10
     
     # Security
     secret_key: str = "your-secret-key-change-this-in-production"
@@ -33,18 +50,45 @@ class Settings(BaseSettings):
     # Database
     database_url: Optional[str] = None
     
+    # Connection pool per database connection (SQLite keeps SQLAlchemy's default).
+    # Each API worker process gets its own pool, so the database may see up to
+    # workers * (pool_size + max_overflow) connections
+    db_pool_size: int = 20
+    db_max_overflow: int = 40
+    db_pool_timeout: int = 30
+    # Seconds to wait when opening a new database connection
+    db_connect_timeout: int = 5
+    
+    # Seconds to cache each connection's schema introspection (0 disables)
+    cache_schema_ttl: int = 300
+    
+    # Directory where introspected schemas are saved for warm restarts (empty disables)
+    cache_dir: str = ".cache"
+    
+    # Query history (SQLite file shared by all workers)
+    history_db_path: str = "query_history.db"
+    
     # CORS
     backend_cors_origins: list = ["http://localhost:3000"]
     
     # Logging
     log_level: str = "INFO"
     
-    class Config:
-        env_file = ".env"
+    model_config = SettingsConfigDict(
+        env_file=".env",
         # This tells Pydantic to convert environment variable names
         # For example: AI_PROVIDER -> ai_provider
-        case_sensitive = False
+        case_sensitive=False,
+        # Ignore unknown variables in .env, as Pydantic v1 did
+        extra="ignore"
+    )
+
+@lru_cache
+def get_settings() -> Settings:
+    """Get application settings, parsing the environment and .env only once"""
+    settings = Settings()
+    logger.debug(f"AI Provider: {settings.ai_provider}")
+    logger.debug(f"LM Studio URL: {settings.lm_studio_base_url}")
+    return settings
 
-settings = Settings()
-print(f"AI Provider: {settings.ai_provider}")
-print(f"LM Studio URL: {settings.lm_studio_base_url}")
\ No newline at end of file
+settings = get_settings()
\ No newline at end of file
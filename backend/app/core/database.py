@@ -1,38 +1,149 @@
-from sqlalchemy import create_engine, MetaData, Table, inspect, text
+from sqlalchemy import create_engine, make_url, MetaData, Row, Table, inspect, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker
-from typing import Dict, List, Any, Optional
+from sqlparse import tokens as sql_tokens
+from sqlparse.sql import Parenthesis
+from typing import Dict, List, Any, Iterator, NamedTuple, Optional, Tuple
 from enum import Enum
+from functools import lru_cache
+from app.core.config import settings
+import hashlib
+import itertools
 import logging
+import os
+import pickle
+import sqlparse
+import tempfile
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Number of rows pulled from the driver per fetch
+FETCH_BATCH_SIZE = 1000
+
+# Each distinct schema a connection reads gets a new version, so anything
+# derived from a schema can be cached against it and goes stale only when the
+# schema actually changes or is explicitly invalidated
+_schema_versions = itertools.count(1)
+
+# Cheap catalog queries whose result changes whenever the schema does, used
+# to check that a schema persisted by an earlier process is still current
+_SCHEMA_FINGERPRINT_SQL = {
+    "sqlite": "PRAGMA schema_version",
+    "postgresql": (
+        "SELECT md5(string_agg(table_schema || '.' || table_name || '.' || column_name"
+        " || ':' || data_type || ':' || is_nullable, ',' ORDER BY table_schema, table_name, ordinal_position)),"
+        " (SELECT count(*) FROM pg_constraint), (SELECT count(*) FROM pg_index)"
+        " FROM information_schema.columns WHERE table_schema NOT IN ('pg_catalog', 'information_schema')"
+    ),
+    "mysql": (
+        "SELECT COUNT(*), SUM(CRC32(CONCAT_WS(',', table_name, column_name, column_type, is_nullable, column_key))),"
+        " (SELECT COUNT(*) FROM information_schema.key_column_usage WHERE table_schema = DATABASE())"
+        " FROM information_schema.columns WHERE table_schema = DATABASE()"
+    ),
+}
+_SCHEMA_FINGERPRINT_SQL["mariadb"] = _SCHEMA_FINGERPRINT_SQL["mysql"]
+
+# Extra DB-API connect() arguments per driver. psycopg 3 switches a query to a
+# server-side prepared statement once it has run this many times on a
+# connection, so re-run dashboards skip parsing and planning.
+_DRIVER_CONNECT_ARGS = {
+    "psycopg": {"prepare_threshold": 5},
+}
+
+# Bumped whenever the layout of persisted schema_info changes
+SCHEMA_CACHE_FORMAT = 2
+
+def _is_write_keyword(token) -> bool:
+    """Whether a token is a keyword that starts a data-modifying statement"""
+    return ((token.ttype in sql_tokens.DML and token.normalized != 'SELECT')
+            or token.ttype in sql_tokens.DDL)
+
+def _has_write_subquery(token_list) -> bool:
+    """Whether any parenthesized part of a parsed statement is itself a write
+    
+    Only the start of each parenthesis counts, so columns that happen to be
+    named like keywords (merge, upsert, drop) and SELECT ... FOR UPDATE pass.
+    """
+    for token in token_list.tokens:
+        if isinstance(token, Parenthesis):
+            inner = [t for t in token.tokens[1:-1] if not t.is_whitespace and t.ttype not in sql_tokens.Comment]
+            if (len(inner) > 1 and _is_write_keyword(inner[0])
+                    and inner[1].ttype not in (sql_tokens.Operator, sql_tokens.Punctuation, sql_tokens.Comparison)):
+                return True
+        if token.is_group and _has_write_subquery(token):
+            return True
+    return False
+
 class DatabaseType(str, Enum):
     MYSQL = "mysql"
     POSTGRESQL = "postgresql"
     MARIADB = "mariadb"
     SQLITE = "sqlite"
 
+class ColumnInfo(NamedTuple):
+    """A column as held in the cached schema (much smaller than a dict per column)"""
+    name: str
+    type: str
+    nullable: bool
+    default: Any
+    primary_key: bool
+
 class DatabaseConnection:
-    def __init__(self, connection_string: str, db_type: DatabaseType):
+    def __init__(self, connection_string: str, db_type: DatabaseType,
+                 schema_cache_ttl: Optional[float] = None,
+                 pool_size: Optional[int] = None,
+                 max_overflow: Optional[int] = None,
+                 pool_timeout: Optional[float] = None):
         self.connection_string = connection_string
         self.db_type = db_type
+        self.pool_size = settings.db_pool_size if pool_size is None else pool_size
+        self.max_overflow = settings.db_max_overflow if max_overflow is None else max_overflow
+        self.pool_timeout = settings.db_pool_timeout if pool_timeout is None else pool_timeout
         self.engine = None
         self.metadata = None
         self._session_factory = None
+        # (loaded_at, schema_info) from the last catalog read; 0 disables caching
+        self._schema_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._schema_ttl = settings.cache_schema_ttl if schema_cache_ttl is None else schema_cache_ttl
+        # Most recent schema read, kept past the TTL so an unchanged re-read
+        # can keep its schema_version
+        self._last_schema: Optional[Dict[str, Any]] = None
+        # Reuse TextClause objects for repeated SQL so SQLAlchemy's compiled
+        # cache is hit instead of re-parsing the statement
+        self._statement = lru_cache(maxsize=256)(text)
     
     def connect(self) -> bool:
         """Establish database connection"""
         try:
             # Create engine with read-only configuration
-            connect_args = {}
+            url = make_url(self.connection_string)
+            if url.drivername in ("postgresql", "postgresql+psycopg2"):
+                # psycopg2 isn't installed; bare postgresql:// URLs would load it
+                # by default, and existing psycopg2 URLs name it explicitly
+                url = url.set(drivername="postgresql+psycopg")
+            
+            connect_args = dict(_DRIVER_CONNECT_ARGS.get(url.get_driver_name(), {}))
+            pool_args = {}
             if self.db_type == DatabaseType.SQLITE:
-                connect_args = {"check_same_thread": False}
+                connect_args["check_same_thread"] = False
+            else:
+                # Fail fast on an unreachable server instead of tying up a
+                # worker thread for the OS TCP timeout
+                connect_args["connect_timeout"] = settings.db_connect_timeout
+                pool_args = {
+                    "pool_size": self.pool_size,
+                    "max_overflow": self.max_overflow,
+                    "pool_timeout": self.pool_timeout
+                }
             
             self.engine = create_engine(
-                self.connection_string,
+                url,
                 connect_args=connect_args,
                 pool_pre_ping=True,  # Verify connections before use
                 pool_recycle=3600,   # Recycle connections every hour
+                **pool_args
             )
             
             # Test connection
@@ -43,6 +154,9 @@ class DatabaseConnection:
             self._session_factory = sessionmaker(bind=self.engine)
             
             logger.info(f"Successfully connected to {self.db_type} database")
+            
+            # Warm start from the schema an earlier process saved, if unchanged
+            self._load_persisted_schema()
             return True
             
         except Exception as e:
@@ -55,65 +169,223 @@ class DatabaseConnection:
             raise Exception("Database not connected")
         return self._session_factory()
     
-    def execute_query(self, query: str) -> List[Dict[str, Any]]:
-        """Execute a read-only SQL query"""
+    def _validate_query(self, query: str):
+        """Reject anything that is not a single read-only SELECT statement"""
+        # Basic security check - only allow SELECT statements. The parser
+        # skips leading comments and types WITH ... SELECT as a SELECT.
+        statements = [stmt for stmt in sqlparse.parse(query) if stmt.token_first(skip_cm=True) is not None]
+        if len(statements) != 1 or statements[0].get_type() != 'SELECT':
+            raise Exception("Only SELECT queries are allowed")
+        statement = statements[0]
+        
+        # SELECT ... INTO creates a table (or, on MySQL, writes a file)
+        if any(token.ttype in sql_tokens.Keyword and token.normalized == 'INTO' for token in statement.tokens):
+            raise Exception("Only SELECT queries are allowed")
+        
+        # A WITH clause or subquery can still wrap INSERT/UPDATE/DELETE
+        if _has_write_subquery(statement):
+            raise Exception("Only SELECT queries are allowed")
+    
+    def execute_query(self, query: str) -> Dict[str, Any]:
+        """Execute a read-only SQL query
+        
+        Returns the column names once under ``columns`` and the rows as
+        plain tuples under ``rows``, so no per-row dict is built.
+        """
         try:
-            # Basic security check - only allow SELECT statements
-            # Remove extra whitespace and newlines, then check
-            query_cleaned = ' '.join(query.strip().split()).upper()
-            if not query_cleaned.startswith('SELECT'):
-                raise Exception("Only SELECT queries are allowed")
+            self._validate_query(query)
             
             with self.engine.connect() as conn:
-                result = conn.execute(text(query))
-                columns = result.keys()
-                rows = result.fetchall()
+                result = conn.execute(self._statement(query))
+                columns = list(result.keys())
                 
-                # Convert to list of dictionaries
-                return [dict(zip(columns, row)) for row in rows]
+                # Pull rows from the driver in batches rather than one
+                # fetchall() call; each batch of Row objects is released as
+                # soon as it has been copied into tuples
+                rows = []
+                while batch := result.fetchmany(FETCH_BATCH_SIZE):
+                    rows.extend(map(tuple, batch))
                 
+                return {"columns": columns, "rows": rows}
+            
+        except DBAPIError as e:
+            logger.error(f"Query execution failed: {e}")
+            if e.connection_invalidated:
+                raise Exception("Database connection is not available")
+            raise Exception(f"Query execution failed: {str(e)}")
         except Exception as e:
             logger.error(f"Query execution failed: {e}")
             raise Exception(f"Query execution failed: {str(e)}")
     
+    def execute_query_batched(self, query: str,
+                              batch_size: int = FETCH_BATCH_SIZE) -> Tuple[List[str], Iterator[List[Row]]]:
+        """Execute a read-only SQL query and return its column names and an
+        iterator over lists of rows as they are fetched
+        
+        Uses a server-side cursor so only ``batch_size`` rows are held in
+        memory at a time. The query runs before this returns, so the column
+        names are known even for an empty result. The connection stays
+        checked out until the iterator is exhausted or closed.
+        """
+        batches = self._stream_batches(query, batch_size)
+        columns = next(batches)
+        return columns, batches
+    
+    def execute_query_stream(self, query: str,
+                             chunk_size: int = FETCH_BATCH_SIZE) -> Tuple[List[str], Iterator[Row]]:
+        """Execute a read-only SQL query and return its column names and an
+        iterator over its rows one at a time"""
+        columns, batches = self.execute_query_batched(query, chunk_size)
+        return columns, itertools.chain.from_iterable(batches)
+    
+    def _stream_batches(self, query: str, batch_size: int) -> Iterator[Any]:
+        """Yield the column names of a streamed query, then its batches of rows"""
+        try:
+            self._validate_query(query)
+            
+            with self.engine.connect() as conn:
+                result = conn.execution_options(
+                    stream_results=True,
+                    yield_per=batch_size
+                ).execute(self._statement(query))
+                
+                yield list(result.keys())
+                for partition in result.partitions():
+                    yield partition
+            
+        except Exception as e:
+            logger.error(f"Streaming query execution failed: {e}")
+            raise Exception(f"Query execution failed: {str(e)}")
+    
     def get_schema_info(self) -> Dict[str, Any]:
-        """Get database schema information"""
+        """Get database schema information (cached for ``cache_schema_ttl`` seconds)"""
+        cached = self._schema_cache
+        if cached is not None and time.monotonic() - cached[0] < self._schema_ttl:
+            return cached[1]
+        
+        # Fingerprint before reading, so a change made mid-read is caught next time
+        fingerprint = self._schema_fingerprint()
+        schema_info = self._load_schema_info()
+        self._assign_schema_version(schema_info)
+        if self._schema_ttl > 0:
+            self._schema_cache = (time.monotonic(), schema_info)
+            if fingerprint is not None:
+                self._persist_schema(fingerprint, schema_info)
+        return schema_info
+    
+    def invalidate_schema_cache(self):
+        """Drop the cached schema so the next lookup re-reads the catalog"""
+        self._schema_cache = None
+        self._last_schema = None
+    
+    def _assign_schema_version(self, schema_info: Dict[str, Any]):
+        """Reuse the previous schema_version if the catalog is unchanged, otherwise take a new one"""
+        last = self._last_schema
+        if last is not None and last["tables"] == schema_info["tables"]:
+            schema_info["schema_version"] = last["schema_version"]
+        else:
+            schema_info["schema_version"] = next(_schema_versions)
+        self._last_schema = schema_info
+    
+    def _schema_cache_path(self) -> Optional[str]:
+        """File the schema is persisted to, or None if it shouldn't be persisted"""
+        if not settings.cache_dir or self.engine is None:
+            return None
+        # In-memory databases don't outlive the process
+        if self.db_type == DatabaseType.SQLITE and self.engine.url.database in (None, "", ":memory:"):
+            return None
+        digest = hashlib.sha256(self.connection_string.encode()).hexdigest()
+        return os.path.join(settings.cache_dir, f"schema_v{SCHEMA_CACHE_FORMAT}_{digest}.pkl")
+    
+    def _schema_fingerprint(self) -> Optional[str]:
+        """Summarize the current catalog state, or None if it can't be read"""
+        sql = _SCHEMA_FINGERPRINT_SQL.get(self.db_type.value)
+        if sql is None or self._schema_cache_path() is None:
+            return None
+        try:
+            with self.engine.connect() as conn:
+                return repr(tuple(conn.exec_driver_sql(sql).one()))
+        except Exception as e:
+            logger.warning(f"Failed to fingerprint schema: {e}")
+            return None
+    
+    def _persist_schema(self, fingerprint: str, schema_info: Dict[str, Any]):
+        """Save the schema for later processes, replacing the file atomically"""
+        path = self._schema_cache_path()
+        try:
+            os.makedirs(settings.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=settings.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump((fingerprint, schema_info), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.warning(f"Failed to persist schema cache: {e}")
+    
+    def _load_persisted_schema(self):
+        """Populate the schema cache from disk if the catalog hasn't changed since"""
+        if self._schema_ttl <= 0:
+            return
+        path = self._schema_cache_path()
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                fingerprint, schema_info = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable schema cache {path}: {e}")
+            return
+        
+        if fingerprint != self._schema_fingerprint():
+            logger.info("Persisted schema is out of date; it will be re-read")
+            return
+        
+        # Anything cached against the old process's version is unrelated
+        schema_info["schema_version"] = next(_schema_versions)
+        self._last_schema = schema_info
+        self._schema_cache = (time.monotonic(), schema_info)
+        logger.info(f"Loaded schema for {len(schema_info['tables'])} tables from {path}")
+    
+    def _load_schema_info(self) -> Dict[str, Any]:
+        """Read schema information from the database catalog"""
         try:
-            inspector = inspect(self.engine)
             schema_info = {
                 "tables": {},
                 "database_type": self.db_type.value
             }
             
-            # Get all table names
-            table_names = inspector.get_table_names()
+            # Reflect every table at once over a single connection instead of
+            # three inspector calls per table. PostgreSQL answers each of these
+            # with one catalog query; MySQL/MariaDB parse one SHOW CREATE TABLE
+            # per table and share it across all three through the inspector cache.
+            with self.engine.connect() as conn:
+                inspector = inspect(conn)
+                all_columns = inspector.get_multi_columns()
+                all_foreign_keys = inspector.get_multi_foreign_keys()
+                all_indexes = inspector.get_multi_indexes()
             
-            for table_name in table_names:
-                # Get columns for each table
-                columns = inspector.get_columns(table_name)
-                
-                # Get foreign keys
-                foreign_keys = inspector.get_foreign_keys(table_name)
-                
-                # Get indexes
-                indexes = inspector.get_indexes(table_name)
-                
+            # Results are keyed by (schema, table_name)
+            for table_key, columns in all_columns.items():
+                table_name = table_key[1]
                 schema_info["tables"][table_name] = {
                     "columns": [
-                        {
-                            "name": col["name"],
-                            "type": str(col["type"]),
-                            "nullable": col["nullable"],
-                            "default": col.get("default"),
-                            "primary_key": col.get("primary_key", False)
-                        }
+                        ColumnInfo(
+                            col["name"],
+                            str(col["type"]),
+                            col["nullable"],
+                            col.get("default"),
+                            col.get("primary_key", False)
+                        )
                         for col in columns
                     ],
-                    "foreign_keys": foreign_keys,
-                    "indexes": indexes
+                    "foreign_keys": all_foreign_keys.get(table_key, []),
+                    "indexes": all_indexes.get(table_key, [])
                 }
             
-            logger.info(f"Retrieved schema for {len(table_names)} tables")
+            logger.info(f"Retrieved schema for {len(schema_info['tables'])} tables")
             return schema_info
             
         except Exception as e:
@@ -136,23 +408,35 @@ class DatabaseConnection:
     
     def close(self):
         """Close database connection"""
-        if self.engine:
-            self.engine.dispose()
-            self.engine = None
+        self.invalidate_schema_cache()
+        # Swap the engine out before disposing it, so concurrent callers see
+        # either the live engine or None, never one being torn down
+        engine, self.engine = self.engine, None
+        if engine:
             self.metadata = None
             self._session_factory = None
+            engine.dispose()
 
 # Global connection manager
 class ConnectionManager:
     def __init__(self):
         self.connections: Dict[str, DatabaseConnection] = {}
+        # Guards changes to the registry only; lookups are plain dict reads,
+        # which are atomic, so they never wait on a lock
+        self._lock = threading.RLock()
     
     def add_connection(self, connection_id: str, connection: DatabaseConnection) -> bool:
         """Add a new database connection"""
-        if connection.connect():
+        # Connect outside the lock so a slow database doesn't block others
+        if not connection.connect():
+            return False
+        with self._lock:
+            replaced = self.connections.get(connection_id)
             self.connections[connection_id] = connection
-            return True
-        return False
+        # Re-adding an ID must not leak the previous engine's pool
+        if replaced is not None and replaced is not connection:
+            replaced.close()
+        return True
     
     def get_connection(self, connection_id: str) -> Optional[DatabaseConnection]:
         """Get a database connection"""
@@ -160,9 +444,16 @@ class ConnectionManager:
     
     def remove_connection(self, connection_id: str):
         """Remove a database connection"""
-        if connection_id in self.connections:
-            self.connections[connection_id].close()
-            del self.connections[connection_id]
+        with self._lock:
+            connection = self.connections.pop(connection_id, None)
+        if connection:
+            connection.close()
+    
+    def invalidate_schema_cache(self, connection_id: str):
+        """Force the schema of a connection to be re-read on next use"""
+        connection = self.connections.get(connection_id)
+        if connection:
+            connection.invalidate_schema_cache()
     
     def list_connections(self) -> List[str]:
         """List all connection IDs"""
@@ -34,8 +34,9 @@ class QueryResult(BaseModel):
     query_id: str
     original_query: str
     generated_sql: str
-    data: List[Dict[str, Any]]
     columns: List[str]
+    # One list of values per row, in the same order as columns
+    rows: List[List[Any]]
     row_count: int
     execution_time: float
     visualization_type: str
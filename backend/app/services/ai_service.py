@@ -1,24 +1,160 @@
 import openai
-from typing import Dict, Any, List
+from typing import Dict, Any, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+from collections import OrderedDict
+from cachetools import TTLCache
 from app.core.config import settings
-import json
+import httpx
+import orjson
 import logging
 import re
+import threading
 
 logger = logging.getLogger(__name__)
 
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP client for AI calls
+    
+    One client is shared by all AI calls so keep-alive connections (and their
+    TLS sessions) are reused across requests. It is async so waiting on the
+    model doesn't tie up a worker thread. Its connections belong to the event
+    loop that opens them, so create it inside the running app.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        # The OpenAI SDK uses this as its request timeout; local models can take
+        # minutes to generate, so it is configurable and generous by default
+        timeout=settings.ai_timeout,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+
+# Per provider: (base URL setting, model setting, model used when there is no
+# model setting). Unknown providers fall back to OpenAI.
+_PROVIDER_CFG = {
+    "openai": ("openai_base_url", None, "gpt-3.5-turbo"),
+    "lmstudio": ("lm_studio_base_url", "lm_studio_model", None),
+    "openai-compatible": ("openai_base_url", "ai_model", None),
+}
+
+# Prompt for SQL generation; only the schema, question and dialect vary
+_PROMPT_TEMPLATE = """
+You are an expert SQL query generator. Convert the following natural language query into a SQL SELECT statement.
+
+Database Schema:
+{schema}
+
+Natural Language Query: "{query}"
+
+Rules:
+1. Only generate SELECT statements
+2. Use proper SQL syntax for {dialect} database
+3. Include appropriate JOINs when needed
+4. Use aggregate functions when appropriate
+5. Add proper WHERE clauses for filtering - be very careful to match the user's intent
+6. Order results logically
+7. Limit results to reasonable amounts (use LIMIT/TOP)
+8. Pay close attention to the exact filtering requirements in the natural language query
+
+Return ONLY a JSON object with these fields:
+{{
+    "sql": "the generated SQL query",
+    "explanation": "brief explanation of what the query does",
+    "visualization_hint": "suggest the best visualization type (table, bar_chart, line_chart, pie_chart, kpi)",
+    "confidence": 0.95
+}}
+
+Do not include any text before or after the JSON object.
+"""
+
+# Markdown code fences some models wrap their JSON answer in
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\n?|\n?```$')
+# The JSON object in the model's answer (a single object, so match greedily)
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Number of schema descriptions kept, most recently used first
+SCHEMA_DESCRIPTION_CACHE_SIZE = 8
+
+# Highest temperature at which generated SQL is stable enough to reuse
+AI_CACHE_MAX_TEMPERATURE = 0.2
+
+# Column name fragments that suggest a time series
+TIME_WORDS = frozenset({'date', 'time', 'created', 'updated'})
+
+def _is_time_column(column: str) -> bool:
+    """Whether a column name looks like a date or timestamp"""
+    column_lower = column.lower()
+    return any(word in column_lower for word in TIME_WORDS)
+
+# Words in a question or identifier ("order_items" -> "order", "items")
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+def _keywords(text: str) -> FrozenSet[str]:
+    """Lowercased words in text, plus their singular forms"""
+    words = set(_WORD_RE.findall(text.lower()))
+    words.update([word[:-1] for word in words if len(word) > 3 and word.endswith('s')])
+    return frozenset(words)
+
+class TableDescription(NamedTuple):
+    """One table's prompt text, with the words used to match it to a query"""
+    name: str
+    text: str
+    name_words: FrozenSet[str]
+    column_words: FrozenSet[str]
+    # Tables this one's foreign keys point to
+    references: FrozenSet[str]
+
 class AIQueryService:
     def __init__(self):
-        self.client = self._initialize_client()
+        # Created on first use, so the app starts even if the AI provider is
+        # misconfigured or not running yet
+        self._client = None
+        # Set by the app on startup (see use_http_client), or created on first use
+        self._http_client: Optional[httpx.AsyncClient] = None
+        # schema_version -> table descriptions, so repeated queries against the
+        # same schema don't rebuild the prompt text
+        self._schema_desc_cache: "OrderedDict[int, List[TableDescription]]" = OrderedDict()
+        self._schema_desc_lock = threading.Lock()
+        # (normalized query, schema_version, model, temperature) -> parsed answer
+        self._response_cache: TTLCache = TTLCache(maxsize=settings.ai_cache_size, ttl=settings.ai_cache_ttl)
+        self._response_cache_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        """The AI client, initialized on first use"""
+        if self._client is None:
+            self._client = self._initialize_client()
+        return self._client
+    
+    def use_http_client(self, http_client: httpx.AsyncClient):
+        """Send AI calls through the given HTTP client from now on"""
+        self._http_client = http_client
+        self._client = None
+    
+    async def close(self):
+        """Close the pooled HTTP connections
+        
+        The next AI call builds a new client, so the service stays usable if
+        the app is started again.
+        """
+        http_client, self._http_client = self._http_client, None
+        self._client = None
+        if http_client is not None:
+            await http_client.aclose()
+    
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """The HTTP client for AI calls, created if the app didn't supply one"""
+        if self._http_client is None:
+            self._http_client = create_http_client()
+        return self._http_client
     
     def _initialize_client(self):
         """Initialize OpenAI client based on AI provider configuration"""
         try:
             if settings.ai_provider == "lmstudio":
                 # Configure for LM Studio
-                client = openai.OpenAI(
+                client = openai.AsyncOpenAI(
                     base_url=settings.lm_studio_base_url,
-                    api_key=settings.lm_studio_api_key  # LM Studio doesn't validate this
+                    api_key=settings.lm_studio_api_key,  # LM Studio doesn't validate this
+                    http_client=self._get_http_client()
                 )
                 logger.info(f"Initialized LM Studio client with base URL: {settings.lm_studio_base_url}")
                 return client
@@ -28,9 +164,10 @@ class AIQueryService:
                 if not settings.openai_base_url:
                     raise ValueError("openai_base_url must be set when using openai-compatible provider")
                 
-                client = openai.OpenAI(
+                client = openai.AsyncOpenAI(
                     base_url=settings.openai_base_url,
-                    api_key=settings.openai_api_key or "not-needed"
+                    api_key=settings.openai_api_key or "not-needed",
+                    http_client=self._get_http_client()
                 )
                 logger.info(f"Initialized OpenAI-compatible client with base URL: {settings.openai_base_url}")
                 return client
@@ -39,7 +176,7 @@ class AIQueryService:
                 if not settings.openai_api_key:
                     raise ValueError("OpenAI API key is required when using openai provider")
                 
-                client = openai.OpenAI(api_key=settings.openai_api_key)
+                client = openai.AsyncOpenAI(api_key=settings.openai_api_key, http_client=self._get_http_client())
                 logger.info("Initialized OpenAI client")
                 return client
                 
@@ -49,54 +186,50 @@ class AIQueryService:
     
     def _get_model_name(self) -> str:
         """Get the appropriate model name based on provider"""
-        if settings.ai_provider == "lmstudio":
-            return settings.lm_studio_model
-        elif settings.ai_provider == "openai-compatible":
-            return settings.ai_model
-        else:
-            return "gpt-3.5-turbo"
+        _, model_setting, default_model = _PROVIDER_CFG.get(settings.ai_provider, _PROVIDER_CFG["openai"])
+        return getattr(settings, model_setting) if model_setting else default_model
+    
+    def _get_base_url(self) -> Optional[str]:
+        """Get the configured base URL for the provider, if any"""
+        url_setting, _, _ = _PROVIDER_CFG.get(settings.ai_provider, _PROVIDER_CFG["openai"])
+        return getattr(settings, url_setting)
+    
+    def _response_cache_key(self, natural_query: str, schema_info: Dict[str, Any]) -> Optional[Tuple]:
+        """Key under which an answer may be cached, or None if it shouldn't be"""
+        version = schema_info.get("schema_version")
+        if (not settings.ai_cache_enabled or version is None
+                or settings.ai_temperature > AI_CACHE_MAX_TEMPERATURE):
+            return None
+        # Case and spacing don't change the question
+        normalized_query = ' '.join(natural_query.lower().split())
+        return (normalized_query, version, self._get_model_name(), settings.ai_temperature)
     
-    def generate_sql(self, natural_query: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
+    async def generate_sql(self, natural_query: str, schema_info: Dict[str, Any]) -> Dict[str, Any]:
         """Convert natural language query to SQL"""
+        cache_key = self._response_cache_key(natural_query, schema_info)
+        if cache_key is not None:
+            with self._response_cache_lock:
+                cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Reusing cached SQL for a repeated query")
+                return dict(cached)
+        
         try:
             # Create a detailed schema description
-            schema_description = self._create_schema_description(schema_info)
+            schema_description = self._get_schema_description(schema_info, natural_query)
             
             # Create the prompt
-            prompt = f"""
-You are an expert SQL query generator. Convert the following natural language query into a SQL SELECT statement.
-
-Database Schema:
-{schema_description}
-
-Natural Language Query: "{natural_query}"
-
-Rules:
-1. Only generate SELECT statements
-2. Use proper SQL syntax for {schema_info.get('database_type', 'generic')} database
-3. Include appropriate JOINs when needed
-4. Use aggregate functions when appropriate
-5. Add proper WHERE clauses for filtering - be very careful to match the user's intent
-6. Order results logically
-7. Limit results to reasonable amounts (use LIMIT/TOP)
-8. Pay close attention to the exact filtering requirements in the natural language query
-
-Return ONLY a JSON object with these fields:
-{{
-    "sql": "the generated SQL query",
-    "explanation": "brief explanation of what the query does",
-    "visualization_hint": "suggest the best visualization type (table, bar_chart, line_chart, pie_chart, kpi)",
-    "confidence": 0.95
-}}
-
-Do not include any text before or after the JSON object.
-"""
+            prompt = _PROMPT_TEMPLATE.format(
+                schema=schema_description,
+                query=natural_query,
+                dialect=schema_info.get('database_type', 'generic')
+            )
 
             # Get the appropriate model name
             model_name = self._get_model_name()
             
             # Call the AI API using the configured client
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=model_name,
                 messages=[
                     {"role": "system", "content": "You are an expert SQL query generator. Always respond with valid JSON."},
@@ -112,21 +245,16 @@ Do not include any text before or after the JSON object.
             # Try to extract JSON from the response
             try:
                 # Remove code block markers if present
-                if content.startswith('```json'):
-                    content = content[7:]
-                if content.endswith('```'):
-                    content = content[:-3]
+                content = _CODE_FENCE_RE.sub('', content)
                 
                 # Try to find JSON object in the response
-                import re
-                # Use DOTALL flag to match across newlines
-                json_match = re.search(r'\{.*?\}', content, re.DOTALL)
+                json_match = _JSON_BLOCK_RE.search(content)
                 if json_match:
                     json_str = json_match.group(0)
-                    result = json.loads(json_str)
+                    result = orjson.loads(json_str)
                 else:
                     # Fallback: try parsing the whole content
-                    result = json.loads(content.strip())
+                    result = orjson.loads(content.strip())
                 
                 # Validate required fields
                 if not all(key in result for key in ['sql', 'explanation', 'visualization_hint']):
@@ -137,9 +265,12 @@ Do not include any text before or after the JSON object.
                     result['confidence'] = 0.8
                 
                 logger.info(f"Successfully generated SQL using {settings.ai_provider} provider")
+                if cache_key is not None:
+                    with self._response_cache_lock:
+                        self._response_cache[cache_key] = dict(result)
                 return result
                 
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 logger.error(f"Failed to parse AI response as JSON: {content}")
                 # Fallback: extract SQL from response
                 sql_lines = [line for line in content.split('\n') if line.strip() and not line.strip().startswith('#')]
@@ -158,19 +289,19 @@ Do not include any text before or after the JSON object.
             # Provide helpful error messages for common local AI issues
             error_msg = str(e)
             if "Connection" in error_msg or "timeout" in error_msg.lower():
-                raise Exception(f"Failed to connect to {settings.ai_provider}. Make sure your AI server is running at {getattr(settings, f'{settings.ai_provider}_base_url', 'the configured URL')}")
+                raise Exception(f"Failed to connect to {settings.ai_provider}. Make sure your AI server is running at {self._get_base_url() or 'the configured URL'}")
             elif "model" in error_msg.lower() and settings.ai_provider == "lmstudio":
                 raise Exception(f"Model '{settings.lm_studio_model}' not found in LM Studio. Please load a model in LM Studio first.")
             else:
                 raise Exception(f"Failed to generate SQL using {settings.ai_provider}: {str(e)}")
     
-    def test_connection(self) -> Dict[str, Any]:
+    async def test_connection(self) -> Dict[str, Any]:
         """Test connection to the AI service"""
         try:
             model_name = self._get_model_name()
             
             # Simple test prompt
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=model_name,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant."},
@@ -186,7 +317,7 @@ Do not include any text before or after the JSON object.
                 "status": "success",
                 "provider": settings.ai_provider,
                 "model": model_name,
-                "base_url": getattr(settings, f'{settings.ai_provider}_base_url', 'default'),
+                "base_url": self._get_base_url() or 'default',
                 "response": content,
                 "message": f"Successfully connected to {settings.ai_provider}"
             }
@@ -196,7 +327,7 @@ Do not include any text before or after the JSON object.
             
             # Provide specific error messages for common issues
             if "Connection" in error_msg or "timeout" in error_msg.lower():
-                message = f"Cannot connect to {settings.ai_provider} at {getattr(settings, f'{settings.ai_provider}_base_url', 'configured URL')}. Make sure the server is running."
+                message = f"Cannot connect to {settings.ai_provider} at {self._get_base_url() or 'configured URL'}. Make sure the server is running."
             elif "model" in error_msg.lower() and settings.ai_provider == "lmstudio":
                 message = f"Model '{settings.lm_studio_model}' not found. Please load a compatible model in LM Studio."
             elif "api" in error_msg.lower() and "key" in error_msg.lower():
@@ -212,61 +343,111 @@ Do not include any text before or after the JSON object.
                 "message": message
             }
 
-    def _create_schema_description(self, schema_info: Dict[str, Any]) -> str:
-        """Create a human-readable schema description"""
-        description_parts = []
+    def _get_schema_description(self, schema_info: Dict[str, Any], natural_query: str) -> str:
+        """Describe the schema for the prompt, limited to the tables most relevant to the query"""
+        tables = self._get_table_descriptions(schema_info)
+        
+        max_tables = settings.ai_schema_max_tables
+        if max_tables > 0 and len(tables) > max_tables:
+            query_words = _keywords(natural_query)
+            scores = [
+                2 * len(query_words & table.name_words) + len(query_words & table.column_words)
+                for table in tables
+            ]
+            # With nothing to go on, send everything rather than guess
+            if any(scores):
+                top = sorted(range(len(tables)), key=scores.__getitem__, reverse=True)[:max_tables]
+                # Tables that don't match at all aren't worth a slot
+                chosen = {tables[i].name for i in top if scores[i] > 0}
+                # Always include what the chosen tables join to, or the model
+                # can't write the joins the question needs
+                chosen.update(*[table.references for table in tables if table.name in chosen])
+                tables = [table for table in tables if table.name in chosen]
+        
+        return "\n\n".join(table.text for table in tables)
+    
+    def _get_table_descriptions(self, schema_info: Dict[str, Any]) -> List[TableDescription]:
+        """Get the per-table descriptions, reusing them while the schema version is unchanged"""
+        version = schema_info.get("schema_version")
+        if version is None:
+            return self._create_table_descriptions(schema_info)
+        
+        with self._schema_desc_lock:
+            tables = self._schema_desc_cache.get(version)
+            if tables is not None:
+                self._schema_desc_cache.move_to_end(version)
+                return tables
+        
+        tables = self._create_table_descriptions(schema_info)
+        with self._schema_desc_lock:
+            self._schema_desc_cache[version] = tables
+            self._schema_desc_cache.move_to_end(version)
+            while len(self._schema_desc_cache) > SCHEMA_DESCRIPTION_CACHE_SIZE:
+                self._schema_desc_cache.popitem(last=False)
+        return tables
+    
+    def _create_table_descriptions(self, schema_info: Dict[str, Any]) -> List[TableDescription]:
+        """Create a human-readable description of each table"""
+        descriptions = []
         
+        # Tables are already grouped by name in schema_info, so each table's
+        # columns and keys are read straight from its entry in a single pass
         for table_name, table_info in schema_info.get("tables", {}).items():
+            columns = table_info.get("columns", [])
             columns_desc = []
-            for col in table_info.get("columns", []):
-                col_desc = f"{col['name']} ({col['type']}"
-                if col.get('primary_key'):
-                    col_desc += ", PRIMARY KEY"
-                if not col.get('nullable', True):
-                    col_desc += ", NOT NULL"
-                col_desc += ")"
-                columns_desc.append(col_desc)
+            for col in columns:
+                attributes = [col.type]
+                if col.primary_key:
+                    attributes.append("PRIMARY KEY")
+                if not col.nullable:
+                    attributes.append("NOT NULL")
+                columns_desc.append(f"{col.name} ({', '.join(attributes)})")
             
-            table_desc = f"Table: {table_name}\nColumns: {', '.join(columns_desc)}"
+            table_lines = [f"Table: {table_name}", f"Columns: {', '.join(columns_desc)}"]
             
             # Add foreign key information
             fks = table_info.get("foreign_keys", [])
             if fks:
-                fk_descs = []
-                for fk in fks:
-                    fk_desc = f"{fk.get('constrained_columns', [])} -> {fk.get('referred_table', '')}.{fk.get('referred_columns', [])}"
-                    fk_descs.append(fk_desc)
-                table_desc += f"\nForeign Keys: {', '.join(fk_descs)}"
+                fk_descs = [
+                    f"{fk.get('constrained_columns', [])} -> {fk.get('referred_table', '')}.{fk.get('referred_columns', [])}"
+                    for fk in fks
+                ]
+                table_lines.append(f"Foreign Keys: {', '.join(fk_descs)}")
             
-            description_parts.append(table_desc)
+            descriptions.append(TableDescription(
+                name=table_name,
+                text="\n".join(table_lines),
+                name_words=_keywords(table_name),
+                column_words=_keywords(" ".join(col.name for col in columns)),
+                references=frozenset(fk.get('referred_table', '') for fk in fks) - {''}
+            ))
         
-        return "\n\n".join(description_parts)
+        return descriptions
     
-    def suggest_visualization(self, data: List[Dict[str, Any]], columns: List[str]) -> str:
+    def suggest_visualization(self, rows: List[Sequence[Any]], columns: List[str]) -> str:
         """Suggest the best visualization type based on data"""
-        if not data or not columns:
+        if not rows or not columns:
             return "table"
         
         # Single value - KPI
-        if len(data) == 1 and len(columns) == 1:
+        if len(rows) == 1 and len(columns) == 1:
             return "kpi"
         
         # Time series detection
-        time_columns = [col for col in columns if any(time_word in col.lower() for time_word in ['date', 'time', 'created', 'updated'])]
-        if time_columns and len(data) > 1:
+        if len(rows) > 1 and any(_is_time_column(col) for col in columns):
             return "line_chart"
         
         # Categorical data with counts
-        if len(columns) == 2 and len(data) <= 20:
+        if len(columns) == 2 and len(rows) <= 20:
             # Check if one column looks like a count/sum
-            numeric_cols = []
-            for row in data[:3]:  # Check first few rows
-                for col, value in row.items():
-                    if isinstance(value, (int, float)) and col not in numeric_cols:
-                        numeric_cols.append(col)
+            numeric_cols = set()
+            for row in rows[:3]:  # Check first few rows
+                for col, value in zip(columns, row):
+                    if isinstance(value, (int, float)):
+                        numeric_cols.add(col)
             
             if numeric_cols:
-                return "bar_chart" if len(data) > 5 else "pie_chart"
+                return "bar_chart" if len(rows) > 5 else "pie_chart"
         
         # Default to table for complex data
         return "table"
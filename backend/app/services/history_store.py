@@ -0,0 +1,94 @@
+from typing import List, Optional
+from app.core.config import settings
+from app.models.schemas import QueryHistory
+import logging
+import orjson
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds a write waits for another worker's lock before failing
+HISTORY_BUSY_TIMEOUT = 5.0
+
+class HistoryStore:
+    """Query history persisted in SQLite, shared by all API workers
+    
+    Every method blocks on SQLite, so callers on the event loop should run
+    them through the query executor.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Opened on first use, so importing the app doesn't create the file
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Open the database and create the schema if needed (call with the lock held)"""
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=HISTORY_BUSY_TIMEOUT, check_same_thread=False, isolation_level=None
+            )
+            # WAL lets several worker processes read while one writes, and in
+            # WAL mode NORMAL sync stays consistent without an fsync per insert
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_history ("
+                "qid TEXT PRIMARY KEY, conn_id TEXT NOT NULL, ts REAL NOT NULL, payload BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_ts ON query_history (ts DESC)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_history_conn_ts ON query_history (conn_id, ts DESC)"
+            )
+            self._conn = conn
+            logger.info(f"Query history stored in {self.path}")
+        return self._conn
+    
+    def add(self, entry: QueryHistory):
+        """Store a query in history"""
+        payload = orjson.dumps(entry.model_dump())
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO query_history (qid, conn_id, ts, payload) VALUES (?, ?, ?, ?)",
+                (entry.query_id, entry.connection_id, entry.timestamp.timestamp(), payload)
+            )
+    
+    def get(self, query_id: str) -> Optional[QueryHistory]:
+        """Get a query from history, or None if it doesn't exist"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT payload FROM query_history WHERE qid = ?", (query_id,)
+            ).fetchone()
+        return QueryHistory.model_validate_json(row[0]) if row else None
+    
+    def list(self, connection_id: Optional[str] = None, limit: int = 50) -> List[QueryHistory]:
+        """List queries, most recent first"""
+        with self._lock:
+            if connection_id:
+                rows = self._connection().execute(
+                    "SELECT payload FROM query_history WHERE conn_id = ? ORDER BY ts DESC LIMIT ?",
+                    (connection_id, limit)
+                ).fetchall()
+            else:
+                rows = self._connection().execute(
+                    "SELECT payload FROM query_history ORDER BY ts DESC LIMIT ?", (limit,)
+                ).fetchall()
+        return [QueryHistory.model_validate_json(row[0]) for row in rows]
+    
+    def delete(self, query_id: str) -> bool:
+        """Delete a query from history, returning whether it existed"""
+        with self._lock:
+            cursor = self._connection().execute("DELETE FROM query_history WHERE qid = ?", (query_id,))
+        return cursor.rowcount > 0
+    
+    def close(self):
+        """Close the database connection, if it was opened"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Global instance
+history_store = HistoryStore(settings.history_db_path)
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from app.core.config import settings
+import asyncio
+import functools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class QueryExecutor:
+    """Thread pool reserved for blocking database calls
+
+    Sized to the database connection pool, so concurrent queries queue on the
+    pool rather than on threads, and database work never competes with the
+    rest of the app for the default threadpool. The threads are started on
+    first use and again after a shutdown, so the app can be started more
+    than once in the same process.
+    """
+    
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """The running thread pool, started if needed"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+            return self._executor
+    
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking call on the pool and wait for its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+    
+    def shutdown(self):
+        """Stop accepting work and drop anything still queued"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.info("Query executor shut down")
+
+# Threads for connection health checks, kept apart so checks against an
+# unresponsive database can't starve real queries
+HEALTH_CHECK_WORKERS = 4
+
+# Global instances
+query_executor = QueryExecutor(settings.db_pool_size)
+health_check_executor = QueryExecutor(HEALTH_CHECK_WORKERS)
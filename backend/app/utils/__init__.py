@@ -0,0 +1 @@
+# Empty __init__.py files to make Python treat directories as packages
\ No newline at end of file
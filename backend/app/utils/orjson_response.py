@@ -0,0 +1,25 @@
+from fastapi.responses import JSONResponse
+from decimal import Decimal
+from typing import Any
+import orjson
+
+def json_default(obj: Any) -> Any:
+    """Serialize types orjson doesn't handle natively"""
+    # Keep database numerics as JSON numbers rather than strings
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+    
+    Datetimes and UUIDs are serialized natively, Decimal values coming back
+    from the database become floats and anything else falls back to ``str``.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=json_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
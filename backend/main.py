@@ -1,23 +1,49 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.api.routes import queries, connections, schema, exports
 from app.core.config import settings
+from app.services.ai_service import ai_service, create_http_client
+from app.services.history_store import history_store
+from app.services.query_executor import health_check_executor, query_executor
+from app.utils.orjson_response import ORJSONResponse
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled AI connections are tied to this event loop, so build them here
+    app.state.http_client = create_http_client()
+    ai_service.use_http_client(app.state.http_client)
+    yield
+    # Release pooled connections and worker threads on shutdown
+    await ai_service.close()
+    query_executor.shutdown()
+    health_check_executor.shutdown()
+    history_store.close()
 
 app = FastAPI(
     title="AskDash API",
     description="AI-powered database query dashboard API",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # CORS middleware to allow React frontend
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # React dev server
+    allow_origin_regex=r"^http://localhost:(3000|5173)$",  # React/Vite dev servers
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Listed explicitly so preflight responses are fixed rather than echoed
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
+# Compress larger responses; query results and exports are highly repetitive
+# JSON/CSV and shrink several times over. Streamed exports are compressed
+# chunk by chunk as they are sent.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Include API routes
 app.include_router(queries.router, prefix="/api/queries", tags=["queries"])
 app.include_router(connections.router, prefix="/api/connections", tags=["connections"])
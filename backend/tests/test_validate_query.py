@@ -0,0 +1,37 @@
+import pytest
+
+from app.core.database import DatabaseConnection, DatabaseType
+
+
+@pytest.fixture
+def connection():
+    return DatabaseConnection("sqlite://", DatabaseType.SQLITE)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT merge, upsert FROM t",
+    "SELECT drop FROM t",
+    "SELECT * FROM t FOR UPDATE",
+    "WITH a AS (SELECT 1) SELECT * FROM a",
+    "SELECT * FROM t WHERE a IN (SELECT b FROM u)",
+    "-- leading comment\nSELECT 1",
+    "select 1;",
+])
+def test_accepts_read_only_select(connection, query):
+    connection._validate_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "",
+    "update t set a = 1",
+    "EXPLAIN SELECT 1",
+    "SELECT * INTO new_t FROM t",
+    "SELECT a INTO TEMP x FROM t",
+    "select 1; delete from x",
+    "WITH a AS (delete from t returning *) select * from a",
+    "WITH a AS (INSERT INTO t VALUES (1) RETURNING *) SELECT * FROM a",
+    "select * from (delete from t returning *) x",
+])
+def test_rejects_anything_else(connection, query):
+    with pytest.raises(Exception, match="Only SELECT queries are allowed"):
+        connection._validate_query(query)
@@ -37,7 +37,7 @@ interface DataVisualizerProps {
 }
 
 const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
-  const { data, columns, visualization_type, query_id } = result;
+  const { rows, columns, visualization_type, query_id } = result;
 
   const colors = ["#9ACD32", "#7CB342", "#689F38", "#558B2F", "#33691E"];
 
@@ -58,9 +58,9 @@ const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
   };
 
   const renderKPI = () => {
-    if (data.length === 0 || columns.length === 0) return null;
+    if (rows.length === 0 || columns.length === 0) return null;
 
-    const value = data[0][columns[0]];
+    const value = rows[0][0];
     const label = columns[0].replace(/_/g, " ").toUpperCase();
 
     return (
@@ -85,11 +85,11 @@ const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
   };
 
   const renderBarChart = () => {
-    if (data.length === 0 || columns.length < 2) return null;
+    if (rows.length === 0 || columns.length < 2) return null;
 
-    const chartData = data.map((row, index) => ({
-      name: row[columns[0]] || `Item ${index + 1}`,
-      value: Number(row[columns[1]]) || 0,
+    const chartData = rows.map((row, index) => ({
+      name: row[0] || `Item ${index + 1}`,
+      value: Number(row[1]) || 0,
     }));
 
     return (
@@ -109,11 +109,11 @@ const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
   };
 
   const renderLineChart = () => {
-    if (data.length === 0 || columns.length < 2) return null;
+    if (rows.length === 0 || columns.length < 2) return null;
 
-    const chartData = data.map((row, index) => ({
-      name: row[columns[0]] || `Point ${index + 1}`,
-      value: Number(row[columns[1]]) || 0,
+    const chartData = rows.map((row, index) => ({
+      name: row[0] || `Point ${index + 1}`,
+      value: Number(row[1]) || 0,
     }));
 
     return (
@@ -138,11 +138,11 @@ const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
   };
 
   const renderPieChart = () => {
-    if (data.length === 0 || columns.length < 2) return null;
+    if (rows.length === 0 || columns.length < 2) return null;
 
-    const chartData = data.map((row) => ({
-      name: row[columns[0]] || "Unknown",
-      value: Number(row[columns[1]]) || 0,
+    const chartData = rows.map((row) => ({
+      name: row[0] || "Unknown",
+      value: Number(row[1]) || 0,
     }));
 
     return (
@@ -174,7 +174,7 @@ const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
   };
 
   const renderTable = () => {
-    if (data.length === 0) return null;
+    if (rows.length === 0) return null;
 
     return (
       <TableContainer component={Paper} sx={{ maxHeight: 500 }}>
@@ -192,12 +192,12 @@ const DataVisualizer: React.FC<DataVisualizerProps> = ({ result }) => {
             </TableRow>
           </TableHead>
           <TableBody>
-            {data.map((row, index) => (
+            {rows.map((row, index) => (
               <TableRow key={index} hover>
-                {columns.map((column) => (
+                {columns.map((column, columnIndex) => (
                   <TableCell key={`${index}-${column}`}>
-                    {row[column] !== null && row[column] !== undefined
-                      ? String(row[column])
+                    {row[columnIndex] !== null && row[columnIndex] !== undefined
+                      ? String(row[columnIndex])
                       : "N/A"}
                   </TableCell>
                 ))}
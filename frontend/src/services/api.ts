@@ -51,6 +51,11 @@ export const schemaApi = {
     return response.data;
   },
 
+  refreshSchema: async (connectionId: string): Promise<SchemaInfo> => {
+    const response = await api.post(`/schema/${connectionId}/refresh`);
+    return response.data;
+  },
+
   listTables: async (
     connectionId: string
   ): Promise<{ tables: string[]; count: number }> => {
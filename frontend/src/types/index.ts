@@ -27,8 +27,8 @@ export interface QueryResult {
   query_id: string;
   original_query: string;
   generated_sql: string;
-  data: Record<string, any>[];
   columns: string[];
+  rows: any[][];
   row_count: number;
   execution_time: number;
   visualization_type: string;